@@ -1,6 +1,9 @@
 # cohort_store.py
 from __future__ import annotations
 
+import os
+import warnings
+
 import duckdb
 from typing import Any, Dict, Iterable, List, Optional, Tuple
 
@@ -27,50 +30,115 @@ class CohortStore:
             tuple format is (op, value) where op in {'>','>=','<','<=','=','!=','LIKE'}
         - metrics(organs=[...], kinds=[...]) -> CohortStore
             picks columns by name tokens (case-insensitive)
+        - select(*cols) -> CohortStore
+            picks columns by exact name
         - to_pandas() / to_polars()
         - save_csv(path) / save_parquet(path)
         - query_sql() -> str
         - reset() -> CohortStore
     """
 
-    _ALLOWED_OPS: Tuple[str, ...] = (">", ">=", "<", "<=", "=", "!=", "LIKE")
+    _ALLOWED_OPS: frozenset = frozenset({">", ">=", "<", "<=", "=", "!=", "LIKE"})
 
     def __init__(self, db_path: str = "cohorts.duckdb", table: str = "raw") -> None:
         self.db_path = db_path
         self.table = table
         self.con = duckdb.connect(db_path)
+        self._tune_connection(self.con)
+        self._columns: Optional[List[str]] = None  # cached schema, see _get_columns()
+        self._quoted_cols: Dict[str, str] = {}  # identifier -> quoted form
+        self._metrics_cache: Dict[Tuple[Any, ...], List[str]] = {}  # (organs, kinds) -> cols
         self._study_col = self._detect_study_col()
         self._where_parts: List[str] = []
         self._params: List[Any] = []
         self._select_cols: Optional[List[str]] = None  # None = select *
+        # Assembled SQL keyed by (select cols, where parts) so loops that
+        # reuse the same filter shape skip the per-call string build and
+        # always hand DuckDB a byte-identical parameterized statement.
+        self._stmt_cache: Dict[Tuple[Any, ...], str] = {}
+        # SQL for the *current* filter/selection state; mutators clear it
+        # so query_sql() followed by to_pandas() builds the string once.
+        self._sql_cache: Optional[str] = None
 
-    # internals 
+    _STMT_CACHE_MAX = 64
 
-    def _detect_study_col(self) -> str:
-        cols = (
-            self.con.execute(f'PRAGMA table_info("{self.table}")')
-            .df()["name"]
-            .tolist()
-        )
-        for c in ("Study", "Study Name", "study", "StudyName", "Study_Name"):
-            if c in cols:
-                return c
-        raise RuntimeError(f"No study column found in table '{self.table}'.")
+    # internals
 
     @staticmethod
-    def _quote_ident(name: str) -> str:
-        """Safely double-quote a DuckDB identifier."""
-        return '"' + name.replace('"', '""') + '"'
+    def _tune_connection(con: duckdb.DuckDBPyConnection) -> None:
+        """Apply analytics-friendly pragmas to a fresh connection."""
+        con.execute("PRAGMA threads=%d" % (os.cpu_count() or 4))
+        con.execute("SET enable_object_cache=true")
+
+    def _get_columns(self) -> List[str]:
+        """Column names of the table, fetched once and cached on the store."""
+        if self._columns is None:
+            rows = self.con.execute(
+                f"PRAGMA table_info({self._quote_ident(self.table)})"
+            ).fetchall()
+            self._columns = [row[1] for row in rows]
+        return self._columns
+
+    def refresh_schema(self) -> None:
+        """Forget the cached column list (call after ALTERing the table)."""
+        self._columns = None
+        self._metrics_cache.clear()
 
-    def _build_sql(self):
-        where_sql = " AND ".join(self._where_parts) if self._where_parts else "1=1"
+    def _detect_study_col(self) -> str:
+        # ask the catalog for just the one matching name instead of pulling
+        # the whole column list; list_position keeps the candidate priority
+        row = self.con.execute(
+            "SELECT column_name FROM duckdb_columns() "
+            "WHERE table_name = ? "
+            "AND column_name IN ('Study', 'Study Name', 'study', 'StudyName', 'Study_Name') "
+            "ORDER BY list_position("
+            "['Study', 'Study Name', 'study', 'StudyName', 'Study_Name'], column_name) "
+            "LIMIT 1",
+            [self.table],
+        ).fetchone()
+        if not row:
+            raise RuntimeError(f"No study column found in table '{self.table}'.")
+        return row[0]
+
+    _QUOTE_TABLE = str.maketrans({'"': '""'})
+
+    def _quote_ident(self, name: str) -> str:
+        """Safely double-quote a DuckDB identifier (memoized per store)."""
+        quoted = self._quoted_cols.get(name)
+        if quoted is None:
+            quoted = self._quoted_cols[name] = (
+                '"' + name.translate(self._QUOTE_TABLE) + '"'
+            )
+        return quoted
 
-        if self._select_cols is None:
-            select = "*"
-        else:
-            select = ", ".join(self._quote_ident(c) for c in self._select_cols)
+    def _build_sql(self):
+        if self._sql_cache is not None:
+            return self._sql_cache, list(self._params)
+        key = (
+            None if self._select_cols is None else tuple(self._select_cols),
+            tuple(self._where_parts),
+        )
+        if self._select_cols is None and len(self._get_columns()) > 50:
+            warnings.warn(
+                "SELECT * on a wide table - call .metrics() or .select() "
+                "to fetch only the columns you need.",
+                UserWarning,
+                stacklevel=3,
+            )
+        sql = self._stmt_cache.get(key)
+        if sql is None:
+            where_sql = " AND ".join(self._where_parts) if self._where_parts else "1=1"
+
+            if self._select_cols is None:
+                select = "*"
+            else:
+                select = ", ".join(self._quote_ident(c) for c in self._select_cols)
 
-        sql = f"SELECT {select} FROM {self._quote_ident(self.table)} WHERE {where_sql}"
+            sql = f"SELECT {select} FROM {self._quote_ident(self.table)} WHERE {where_sql}"
+            if len(self._stmt_cache) >= self._STMT_CACHE_MAX:
+                self._stmt_cache.pop(next(iter(self._stmt_cache)))
+            self._stmt_cache[key] = sql
+        self._sql_cache = sql
         return sql, list(self._params)
 
     #  basic ops
@@ -78,6 +146,7 @@ class CohortStore:
     def reset(self) -> "CohortStore":
         """Clear previous selections/filters."""
         self._where_parts, self._params, self._select_cols = [], [], None
+        self._sql_cache = None
         return self
 
     def list_studies(self):
@@ -87,9 +156,22 @@ class CohortStore:
         """
         return self.con.execute("SELECT * FROM studies ORDER BY study_name").df()
 
+    def first_study(self) -> str:
+        """
+        Return the first study name (alphabetically) without materializing
+        the whole studies view as a DataFrame.
+        """
+        row = self.con.execute(
+            "SELECT study_name FROM studies ORDER BY study_name LIMIT 1"
+        ).fetchone()
+        if not row:
+            raise RuntimeError("No studies available.")
+        return row[0]
+
     def select_cohort(self, name: str) -> "CohortStore":
         self._where_parts.append(f"{self._quote_ident(self._study_col)} = ?")
         self._params.append(name)
+        self._sql_cache = None
         return self
 
     def filter(self, **columns: Dict[str, Any]) -> "CohortStore":
@@ -102,17 +184,28 @@ class CohortStore:
             col_q = self._quote_ident(col)
             if isinstance(val, tuple) and len(val) == 2:
                 op, v = val
-                op_u = str(op).upper()
+                # skip the upper-casing when the operator is already canonical
+                op_u = op if op in self._ALLOWED_OPS else str(op).upper()
                 if op_u not in self._ALLOWED_OPS:
                     raise ValueError(
                         f"Unsupported operator '{op}' for column '{col}'. "
-                        f"Allowed: {self._ALLOWED_OPS}"
+                        f"Allowed: {sorted(self._ALLOWED_OPS)}"
                     )
                 self._where_parts.append(f"{col_q} {op_u} ?")
                 self._params.append(v)
             else:
                 self._where_parts.append(f"{col_q} = ?")
                 self._params.append(val)
+        self._sql_cache = None
+        return self
+
+    def select(self, *cols: str) -> "CohortStore":
+        """
+        Pick columns by exact name:
+            select("Image/Patient ID", "Volume Liver")
+        """
+        self._select_cols = list(cols)
+        self._sql_cache = None
         return self
 
     def metrics(
@@ -127,20 +220,35 @@ class CohortStore:
         -> matches columns containing 'Liver' AND (either 'Volume' OR 'SUVMean').
         The detected study column and one ID-like column are always included if present.
         """
-        colnames: List[str] = (
-            self.con.execute(f'PRAGMA table_info("{self.table}")').df()["name"].tolist()
+        # the column pick is deterministic in (schema, organs, kinds),
+        # so repeated slices skip the duckdb_columns() round-trip
+        key = (
+            tuple(sorted(o.lower() for o in organs)) if organs else (),
+            tuple(sorted(k.lower() for k in kinds)) if kinds else (),
         )
-
-        organs_list = list(organs) if organs else []
-        kinds_list = list(kinds) if kinds else []
-
-        def matches(name: str) -> bool:
-            n = name.lower()
-            ok_org = any(o.lower() in n for o in organs_list) if organs_list else True
-            ok_kind = any(k.lower() in n for k in kinds_list) if kinds_list else True
-            return ok_org and ok_kind
-
-        keep: List[str] = [c for c in colnames if matches(c)]
+        cached = self._metrics_cache.get(key)
+        if cached is not None:
+            self._select_cols = list(cached)
+            self._sql_cache = None
+            return self
+
+        colnames: List[str] = self._get_columns()
+
+        # Match column names inside DuckDB so only the matching names come
+        # back, instead of filtering the whole schema in Python. contains()
+        # keeps plain substring semantics ('%'/'_' in tokens stay literal,
+        # unlike LIKE), and the empty token keeps a group wide open when no
+        # tokens were given for it.
+        tokens_org = [o.lower() for o in organs] if organs else [""]
+        tokens_knd = [k.lower() for k in kinds] if kinds else [""]
+        rows = self.con.execute(
+            "SELECT column_name FROM duckdb_columns() "
+            "WHERE table_name = ? "
+            "AND list_bool_or(list_transform(?::VARCHAR[], x -> contains(lower(column_name), x))) "
+            "AND list_bool_or(list_transform(?::VARCHAR[], x -> contains(lower(column_name), x)))",
+            [self.table, tokens_org, tokens_knd],
+        ).fetchall()
+        keep: List[str] = [r[0] for r in rows]
 
         base_cols: List[str] = [self._study_col] if self._study_col in colnames else []
         for candidate in ("Image/Patient ID", "Patient ID", "Image ID", "ID"):
@@ -148,21 +256,32 @@ class CohortStore:
                 base_cols.append(candidate)
                 break
 
-        # to de-duplicate while keeping order
-        seen = set()
-        ordered: List[str] = []
-        for c in base_cols + keep:
-            if c not in seen:
-                seen.add(c)
-                ordered.append(c)
-
-        self._select_cols = ordered
+        # dict preserves insertion order, so this de-duplicates in one pass
+        ordered = list(dict.fromkeys(base_cols + keep))
+        self._metrics_cache[key] = ordered
+        self._select_cols = list(ordered)
+        self._sql_cache = None
         return self
 
     #  materialization 
 
-    def to_pandas(self):
+    def to_pandas(self, backend: str = "numpy"):
+        """
+        Materialize the current query as a pandas DataFrame.
+
+        backend="pyarrow" returns Arrow-backed columns (pd.ArrowDtype), so
+        strings stay as Arrow arrays instead of being boxed into Python
+        objects - much faster to export again via to_parquet/to_csv.
+        """
         sql, params = self._build_sql()
+        if backend == "pyarrow":
+            import pandas as pd
+
+            return self.con.execute(sql, params).fetch_arrow_table().to_pandas(
+                types_mapper=pd.ArrowDtype
+            )
+        if backend != "numpy":
+            raise ValueError(f"Unsupported backend '{backend}'. Allowed: 'numpy', 'pyarrow'")
         return self.con.execute(sql, params).df()
 
     def to_polars(self):
@@ -174,16 +293,33 @@ class CohortStore:
                 "Polars is not installed. Run `pip install polars` to use to_polars()."
             ) from e
         sql, params = self._build_sql()
-        pdf = self.con.execute(sql, params).df()
-        return pl.from_pandas(pdf)
+        # DuckDB's result buffers are already Arrow, so this path is zero-copy.
+        tbl = self.con.execute(sql, params).fetch_arrow_table()
+        return pl.from_arrow(tbl)
 
     def save_csv(self, path: str):
-        """Materialize current query to CSV."""
-        self.to_pandas().to_csv(path, index=False)
+        """Materialize current query to CSV (streamed by DuckDB)."""
+        # COPY binds the first positional parameter as the target file, so
+        # the path must be inlined as an escaped literal, not bound.
+        sql, params = self._build_sql()
+        path_lit = path.replace("'", "''")
+        self.con.execute(
+            f"COPY ({sql}) TO '{path_lit}' (FORMAT 'csv', HEADER)", params
+        )
 
     def save_parquet(self, path: str):
         """Materialize current query to Parquet (columnar, compressed)."""
-        self.to_pandas().to_parquet(path, index=False)
+        # COPY streams row groups straight from the query, so the result
+        # never has to fit in memory as a pandas DataFrame. The path is
+        # inlined (see save_csv) because COPY would otherwise bind it as
+        # the first query parameter.
+        sql, params = self._build_sql()
+        path_lit = path.replace("'", "''")
+        self.con.execute(
+            f"COPY ({sql}) TO '{path_lit}' "
+            f"(FORMAT 'parquet', COMPRESSION 'zstd', ROW_GROUP_SIZE 100_000)",
+            params,
+        )
 
 
     def query_sql(self) -> str:
@@ -3,9 +3,10 @@ from cohortstore import CohortStore
 store = CohortStore("cohorts.duckdb")
 
 print("\n=== Studies ===")
-print(store.list_studies())
+studies = store.list_studies()
+print(studies)
 
-first_study = store.list_studies().iloc[0]["study_name"]
+first_study = studies.iloc[0]["study_name"]
 
 # Example A: cohort + simple filters 
 df_a = (
@@ -39,7 +40,7 @@ print(all_cols)
 from cohort_store import CohortStore
 
 store = CohortStore("cohorts.duckdb")
-first_study = store.list_studies().iloc[0]["study_name"]
+first_study = store.first_study()
 
 df_liver = (
     store.reset()
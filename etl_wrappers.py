@@ -1,41 +1,98 @@
 
 
+import os
 from typing import Dict, Iterable, Optional
 import duckdb
 import pandas as pd
 
 
-def build_db_from_csv(csv_path: str, db_path: str = "cohorts.duckdb", table: str = "raw") -> None:
-    """Full rebuild: create/replace the DuckDB table from a CSV. Simple & safe for small data."""
-    con = duckdb.connect(db_path)
-    try:
-        df = pd.read_csv(csv_path)
-        con.execute(f"DROP TABLE IF EXISTS {table}")
-        con.execute(f"CREATE TABLE {table} AS SELECT * FROM df")
-
-        cols = con.execute(f"PRAGMA table_info('{table}')").df()["name"].tolist()
-        study_col = "Study Name" if "Study Name" in cols else ("Study" if "Study" in cols else None)
-        if study_col:
-            con.execute("DROP VIEW IF EXISTS studies")
-            con.execute(f"""
-                CREATE VIEW studies AS
-                SELECT DISTINCT "{study_col}" AS study_name
-                FROM {table}
-                WHERE "{study_col}" IS NOT NULL
-            """)
-    finally:
+# One shared connection per database file: opening a DuckDB file pays a
+# catalog-load cost, and reusing the connection lets its internal caches
+# warm up across calls. Call close_all() when you're done.
+_CONNS: Dict[str, duckdb.DuckDBPyConnection] = {}
+
+
+def _get_con(db_path: str) -> duckdb.DuckDBPyConnection:
+    con = _CONNS.get(db_path)
+    if con is None:
+        con = _CONNS[db_path] = duckdb.connect(db_path)
+        con.execute("PRAGMA threads=%d" % (os.cpu_count() or 4))
+        con.execute("SET enable_object_cache=true")
+    return con
+
+
+def close_all() -> None:
+    """Close every cached connection (e.g. at the end of a notebook)."""
+    for con in _CONNS.values():
         con.close()
+    _CONNS.clear()
+
+
+def build_db_from_csv(csv_path: str, db_path: str = "cohorts.duckdb", table: str = "raw") -> None:
+    """
+    Full rebuild: load the CSV and store it as a Parquet file sorted by the
+    study column, exposed through a view named `table`. Sorting means each
+    Parquet row group covers few studies, so `WHERE "Study Name" = ?` skips
+    most of the file via row-group statistics. If no study column is found
+    the data stays as a plain DuckDB table.
+
+    Note: append_rows_from_csv/upsert_rows_from_csv need a real table;
+    after a Parquet-backed rebuild, re-run this to pick up new data.
+    """
+    con = _get_con(db_path)
+    # DROP VIEW IF EXISTS still errors when the name belongs to a table
+    # (e.g. a db built by ingest.py), so check the catalog first.
+    row = con.execute(
+        "SELECT table_type FROM information_schema.tables WHERE table_name = ?",
+        [table],
+    ).fetchone()
+    if row and row[0] == "VIEW":
+        con.execute(f"DROP VIEW {table}")
+    # DuckDB's own CSV reader parses in parallel and writes straight into
+    # the table, so the file never has to fit in memory as a DataFrame.
+    con.execute(
+        f"CREATE OR REPLACE TABLE {table} AS SELECT * FROM read_csv_auto(?, header=true)",
+        [csv_path],
+    )
+
+    cols = con.execute(f"PRAGMA table_info('{table}')").df()["name"].tolist()
+    study_col = "Study Name" if "Study Name" in cols else ("Study" if "Study" in cols else None)
+    if study_col:
+        parquet_path = os.path.join(
+            os.path.dirname(os.path.abspath(db_path)), f"{table}.parquet"
+        )
+        # inline the path: COPY treats a bound parameter as the target
+        # file, which mis-binds as soon as the inner SELECT has parameters
+        pq_lit = parquet_path.replace("'", "''")
+        con.execute(
+            f'COPY (SELECT * FROM {table} ORDER BY "{study_col}") '
+            f"TO '{pq_lit}' (FORMAT 'parquet', ROW_GROUP_SIZE 50_000)"
+        )
+        con.execute(f"DROP TABLE {table}")
+        con.execute(
+            f"CREATE VIEW {table} AS SELECT * FROM read_parquet('{pq_lit}')"
+        )
+        con.execute("DROP VIEW IF EXISTS studies")
+        con.execute(f"""
+            CREATE VIEW studies AS
+            SELECT DISTINCT "{study_col}" AS study_name
+            FROM {table}
+            WHERE "{study_col}" IS NOT NULL
+        """)
+    # refresh optimizer statistics after the rebuild
+    con.execute("ANALYZE")
 
 
 def append_rows_from_csv(csv_path: str, db_path: str = "cohorts.duckdb", table: str = "raw") -> None:
     """Append new rows (no dedup). Use when the CSV only contains brand-new patients."""
-    con = duckdb.connect(db_path)
-    try:
-        df_new = pd.read_csv(csv_path)
-        con.execute(f"CREATE TABLE IF NOT EXISTS {table} AS SELECT * FROM df_new LIMIT 0")
-        con.execute(f"INSERT INTO {table} SELECT * FROM df_new")
-    finally:
-        con.close()
+    con = _get_con(db_path)
+    con.execute(
+        f"CREATE TABLE IF NOT EXISTS {table} AS SELECT * FROM read_csv_auto(?, header=true) LIMIT 0",
+        [csv_path],
+    )
+    con.execute(
+        f"INSERT INTO {table} SELECT * FROM read_csv_auto(?, header=true)", [csv_path]
+    )
 
 
 def upsert_rows_from_csv(csv_path: str,
@@ -43,30 +100,35 @@ def upsert_rows_from_csv(csv_path: str,
                          table: str = "raw",
                          id_cols: Iterable[str] = ("Image/Patient ID", "Study Name")) -> None:
     """
-    Basic UPSERT: delete rows that have same keys (id_cols), then insert new rows.
-    Simple and beginner-friendly; good enough for small data.
+    UPSERT keyed on id_cols: update matching rows, insert the rest.
+    Runs as one INSERT ... ON CONFLICT so the table is scanned once;
+    requires the keys to be unique (the index below enforces that).
     """
-    con = duckdb.connect(db_path)
-    try:
-        df_new = pd.read_csv(csv_path)
-        con.register("incoming", df_new)
-        con.execute(f"CREATE TABLE IF NOT EXISTS {table} AS SELECT * FROM incoming LIMIT 0")
-
-        conditions = " AND ".join([f't."{c}" = i."{c}"' for c in id_cols])
-        con.execute(f"""DELETE FROM {table} t USING incoming i WHERE {conditions}""")
-        con.execute(f"""INSERT INTO {table} SELECT * FROM incoming""")
-    finally:
-        con.close()
+    con = _get_con(db_path)
+    # CREATE VIEW can't take bound parameters, so quote the path inline.
+    csv_lit = csv_path.replace("'", "''")
+    con.execute(
+        f"CREATE OR REPLACE TEMP VIEW incoming AS SELECT * FROM read_csv_auto('{csv_lit}', header=true)"
+    )
+    con.execute(f"CREATE TABLE IF NOT EXISTS {table} AS SELECT * FROM incoming LIMIT 0")
+
+    id_cols = list(id_cols)
+    key_sql = ", ".join(f'"{c}"' for c in id_cols)
+    con.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS uq_{table}_key ON {table} ({key_sql})")
+
+    cols = [r[1] for r in con.execute(f"PRAGMA table_info('{table}')").fetchall()]
+    set_sql = ", ".join(f'"{c}" = EXCLUDED."{c}"' for c in cols if c not in id_cols)
+    con.execute(
+        f"INSERT INTO {table} SELECT * FROM incoming "
+        f"ON CONFLICT ({key_sql}) DO UPDATE SET {set_sql}"
+    )
 
 
  
 
 def list_studies(db_path: str = "cohorts.duckdb") -> pd.DataFrame:
-    con = duckdb.connect(db_path)
-    try:
-        return con.execute("SELECT * FROM studies ORDER BY study_name").df()
-    finally:
-        con.close()
+    con = _get_con(db_path)
+    return con.execute("SELECT * FROM studies ORDER BY study_name").df()
 
 
 def query_cohort(study_name: str,
@@ -77,53 +139,50 @@ def query_cohort(study_name: str,
                  kinds: Optional[Iterable[str]] = None,
                  limit: Optional[int] = None) -> pd.DataFrame:
     """Beginner version of your demo: pick a study, optional filters, optional metric columns."""
-    con = duckdb.connect(db_path)
-    try:
-        cols = con.execute(f"PRAGMA table_info('{table}')").df()["name"].tolist()
-        study_col = "Study Name" if "Study Name" in cols else ("Study" if "Study" in cols else None)
-        if not study_col:
-            raise RuntimeError("No 'Study Name' or 'Study' column found.")
-
-        # WHERE parts
-        where_parts = [f'"{study_col}" = ?']
-        params = [study_name]
-
-        if filters:
-            for col, val in filters.items():
-                if isinstance(val, tuple) and len(val) == 2:
-                    op, v = val
-                    where_parts.append(f'"{col}" {op} ?')
-                    params.append(v)
-                else:
-                    where_parts.append(f'"{col}" = ?')
-                    params.append(val)
-
-        where_sql = " AND ".join(where_parts) if where_parts else "1=1"
-
-        # SELECT columns
-        if organs or kinds:
-            def matches(name: str) -> bool:
-                n = name.lower()
-                ok_org = any(o.lower() in n for o in organs) if organs else True
-                ok_kind = any(k.lower() in n for k in kinds) if kinds else True
-                return ok_org and ok_kind
-
-            keep = [c for c in cols if matches(c)]
-            base = [study_col]
-            for c in ["Image/Patient ID", "Patient ID", "Image ID", "ID"]:
-                if c in cols and c not in base:
-                    base.append(c)
-                    break
-            select_cols = base + keep
-            select_sql = ", ".join(f'"{c}"' for c in select_cols)
-        else:
-            select_sql = "*"
-
-        limit_sql = f" LIMIT {int(limit)}" if limit else ""
-        sql = f'SELECT {select_sql} FROM {table} WHERE {where_sql}{limit_sql}'
-        return con.execute(sql, params).df()
-    finally:
-        con.close()
+    con = _get_con(db_path)
+    cols = con.execute(f"PRAGMA table_info('{table}')").df()["name"].tolist()
+    study_col = "Study Name" if "Study Name" in cols else ("Study" if "Study" in cols else None)
+    if not study_col:
+        raise RuntimeError("No 'Study Name' or 'Study' column found.")
+
+    # WHERE parts
+    where_parts = [f'"{study_col}" = ?']
+    params = [study_name]
+
+    if filters:
+        for col, val in filters.items():
+            if isinstance(val, tuple) and len(val) == 2:
+                op, v = val
+                where_parts.append(f'"{col}" {op} ?')
+                params.append(v)
+            else:
+                where_parts.append(f'"{col}" = ?')
+                params.append(val)
+
+    where_sql = " AND ".join(where_parts) if where_parts else "1=1"
+
+    # SELECT columns
+    if organs or kinds:
+        def matches(name: str) -> bool:
+            n = name.lower()
+            ok_org = any(o.lower() in n for o in organs) if organs else True
+            ok_kind = any(k.lower() in n for k in kinds) if kinds else True
+            return ok_org and ok_kind
+
+        keep = [c for c in cols if matches(c)]
+        base = [study_col]
+        for c in ["Image/Patient ID", "Patient ID", "Image ID", "ID"]:
+            if c in cols and c not in base:
+                base.append(c)
+                break
+        select_cols = base + keep
+        select_sql = ", ".join(f'"{c}"' for c in select_cols)
+    else:
+        select_sql = "*"
+
+    limit_sql = f" LIMIT {int(limit)}" if limit else ""
+    sql = f'SELECT {select_sql} FROM {table} WHERE {where_sql}{limit_sql}'
+    return con.execute(sql, params).df()
 
 
 def save_to_csv(df: pd.DataFrame, path: str) -> None:
@@ -1,21 +1,37 @@
 import os
 import duckdb
-import pandas as pd
 
 CSV_PATH = os.path.join("data", "Merged_master_file.csv")
 DB_PATH  = "cohorts.duckdb"
 
 
-df = pd.read_csv(CSV_PATH)
-df.columns = [c.strip() for c in df.columns]
-
 con = duckdb.connect(DB_PATH)
-con.execute("DROP TABLE IF EXISTS raw")
-con.register("df_view", df)
-con.execute("CREATE TABLE raw AS SELECT * FROM df_view")
+# a Parquet-backed rebuild (etl_wrappers.build_db_from_csv) leaves raw as
+# a view, which CREATE OR REPLACE TABLE refuses to replace - drop it first
+row = con.execute(
+    "SELECT table_type FROM information_schema.tables WHERE table_name = 'raw'"
+).fetchone()
+if row and row[0] == "VIEW":
+    con.execute("DROP VIEW raw")
+
+# let DuckDB parse the CSV itself (parallel, streams into the table)
+# instead of going through a full pandas DataFrame first
+con.execute(
+    "CREATE OR REPLACE TABLE raw AS SELECT * FROM read_csv_auto(?, header=true)",
+    [CSV_PATH],
+)
+
+# strip stray whitespace from column names inside DuckDB
+cols = [r[0] for r in con.execute(
+    "SELECT column_name FROM duckdb_columns() WHERE table_name = 'raw'"
+).fetchall()]
+for c in cols:
+    stripped = c.strip()
+    if stripped != c:
+        con.execute(f'ALTER TABLE raw RENAME COLUMN "{c}" TO "{stripped}"')
+cols = [c.strip() for c in cols]
 
 #  detect study column name safely
-cols = con.execute("PRAGMA table_info('raw')").df()["name"].tolist()
 candidates = ["Study", "Study Name", "study", "StudyName", "Study_Name"]
 study_cols = [c for c in candidates if c in cols]
 
@@ -27,10 +43,19 @@ if not study_cols:
 
 parts = []
 for sc in study_cols:
-    parts.append(f'SELECT DISTINCT "{sc}" AS study_name FROM raw WHERE "{sc}" IS NOT NULL')
-
-view_sql = " CREATE OR REPLACE VIEW studies AS \n" + " \nUNION\n ".join(parts)
+    parts.append(f'SELECT "{sc}" AS study_name FROM raw WHERE "{sc}" IS NOT NULL')
+
+# one DISTINCT over a UNION ALL collapses to a single hash aggregation,
+# instead of one per candidate column plus a distinct-union on top
+view_sql = (
+    "CREATE OR REPLACE VIEW studies AS SELECT DISTINCT study_name FROM (\n"
+    + " \nUNION ALL\n ".join(parts)
+    + "\n)"
+)
 con.execute(view_sql)
 
+# speed up point lookups like WHERE "Study Name" = ?
+con.execute(f'CREATE INDEX IF NOT EXISTS idx_raw_study ON raw ("{study_cols[0]}")')
+
 con.close()
 print(" Created cohorts.duckdb with table 'raw' and view 'studies'")